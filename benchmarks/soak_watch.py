@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+长时间运行模式的内存浸泡测试：使用假的后端数据，反复执行 watch 模式下每次采样的完整流程
+（更新 AtlasCardCollection、累计能耗、会话统计、排序过滤后渲染、json-compact 编码），
+使用 tracemalloc 检查每次采样的内存分配以及总内存占用是否保持平稳：
+平稳性按后一半检查点之间的增长判断（排除了开始阶段一次性的缓存、统计对象等开销，持续的泄漏仍然会线性增长），
+另有一个较宽松的总增长上限；
+
+    python benchmarks/soak_watch.py --iterations 100000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blessed import Terminal  # noqa: E402
+
+from npustat.core import update_collection  # noqa: E402
+from npustat.energy import EnergyMeter  # noqa: E402
+from npustat.serialize import SnapshotEncoder  # noqa: E402
+from npustat.stats import SessionStats  # noqa: E402
+from npustat.view import WatchView  # noqa: E402
+
+
+class FakeBackend:
+    """ 模拟 query_backend 的返回值：num_cards 张加速卡，每张卡 chips_per_card 个芯片，数值随采样变化 """
+
+    def __init__(self, num_cards=8, chips_per_card=2):
+        self.num_cards = num_cards
+        self.chips_per_card = chips_per_card
+        self.start = datetime(2022, 1, 1)
+        self.tick = 0
+
+    def __call__(self):
+        self.tick += 1
+        i = self.tick
+        card_entry_list = []
+        for card_id in range(self.num_cards):
+            chip_entry_list = []
+            for chip_id in range(self.chips_per_card):
+                device_id = card_id * self.chips_per_card + chip_id
+                chip_entry_list.append({
+                    "chip_id": chip_id,
+                    "device_id": device_id,
+                    "health": "OK" if (i + device_id) % 97 else "Warning",
+                    "chip_name": "Ascend 310",
+                    "temperature": 40 + (i * 7 + device_id) % 40,
+                    "ai_core_usage": (i * 13 + device_id) % 101,
+                    "memory_used": f"{(i * 31 + device_id) % 8192} MB",
+                    "memory_total": "8192 MB",
+                })
+            card_entry_list.append({
+                "card_id": card_id,
+                "type": "Atlas 300I-3000",
+                "power": 15.0 + (i + card_id) % 10,
+                "chip_entry_list": chip_entry_list,
+            })
+        return "ascend-dmi version: fake", card_entry_list, self.start + timedelta(seconds=i)
+
+
+class NullWriter:
+    """ 丢弃所有输出的 fp """
+
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--warmup", type=int, default=1000)
+    parser.add_argument("--max-slope-kb", type=float, default=16.0,
+                        help="后一半检查点之间（从中间的检查点到最后一个检查点）内存允许增长的上限，单位：KB；"
+                             "用于发现缓慢的内存泄漏；")
+    parser.add_argument("--max-growth-kb", type=float, default=256.0,
+                        help="预热之后总内存允许增长的上限（包括一次性的开销），单位：KB；")
+    parser.add_argument("--max-tick-kb", type=float, default=256.0,
+                        help="单次采样的内存分配峰值上限，单位：KB；")
+    args = parser.parse_args()
+
+    term = Terminal(kind="xterm-256color", force_styling=True)
+    backend = FakeBackend()
+    view = WatchView()
+    energy_meter = EnergyMeter()
+    session_stats = SessionStats()
+    encoder = SnapshotEncoder("json-compact")
+    fp = NullWriter()
+    state = {"atlas_stat": None}
+
+    def tick(i):
+        atlas_stat = update_collection(state["atlas_stat"], backend(), term=term, no_header=False)
+        state["atlas_stat"] = atlas_stat
+        energy_meter.update(atlas_stat)
+        session_stats.update(atlas_stat)
+        if i % 50 == 0:
+            view.handle_key("tamo"[i // 50 % 4], atlas_stat)
+        view.apply(atlas_stat)
+        atlas_stat.print_formatted(fp, rows=view.arrange(atlas_stat))
+        fp.write(session_stats.footer())
+        fp.write(view.status_line(age=0.0))
+        fp.write(encoder.encode(atlas_stat).decode("utf-8"))
+
+    for i in range(args.warmup):
+        tick(i)
+
+    tracemalloc.start()
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+    max_tick = 0
+    checkpoints = []
+    start_time = time.time()
+    for i in range(args.iterations):
+        before = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        tick(args.warmup + i)
+        current, peak = tracemalloc.get_traced_memory()
+        max_tick = max(max_tick, peak - before)
+        if (i + 1) % max(1, args.iterations // 10) == 0:
+            checkpoints.append(current - baseline)
+    elapsed = time.time() - start_time
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    print(f"iterations: {args.iterations}, elapsed: {elapsed:.1f}s ({elapsed / args.iterations * 1e6:.0f} us/tick with tracemalloc)")
+    print(f"memory growth after warmup: {growth / 1024:.1f} KB; checkpoints (KB): "
+          f"{', '.join(f'{c / 1024:.1f}' for c in checkpoints)}")
+    slope = checkpoints[-1] - checkpoints[len(checkpoints) // 2] if len(checkpoints) >= 2 else 0
+    print(f"growth over the second half of checkpoints: {slope / 1024:.1f} KB")
+    print(f"max allocation per tick: {max_tick / 1024:.1f} KB")
+
+    assert slope <= args.max_slope_kb * 1024, f"memory kept growing by {slope / 1024:.1f} KB between checkpoints"
+    assert growth <= args.max_growth_kb * 1024, f"memory grew by {growth / 1024:.1f} KB"
+    assert max_tick <= args.max_tick_kb * 1024, f"a single tick allocated {max_tick / 1024:.1f} KB"
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
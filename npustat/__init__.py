@@ -5,13 +5,15 @@ The npustat module.
 __version__ = "0.0.3"
 
 from .ascend_dmi import GetCardStatusWithAscendDmi
+from .cache import QueryCache
 from .cli import main, print_atlas_stat, loop_atlas_stat
-from .core import AtlasCardCollection, AtlasCard
+from .core import AtlasCardCollection, AtlasCard, new_query
 from .npu_smi import GetEntryCardListV1, GetCardStatusWithNpuSmi
 
 __all__ = (
     "__version__",
-    "AtlasCardCollection", "AtlasCard",
+    "AtlasCardCollection", "AtlasCard", "new_query",
+    "QueryCache",
     "GetCardStatusWithAscendDmi",
     "GetEntryCardListV1", "GetCardStatusWithNpuSmi",
     "main", "print_atlas_stat", "loop_atlas_stat",
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import msgpack  # 可选依赖，仅读取 msgpack 格式的记录需要
+except ImportError:
+    msgpack = None
+
+from .view import to_number
+
+# 汇总视图中的列；每个芯片的每次采样为一行
+COLUMNS = (
+    "hostname", "query_time", "card_id", "card_type", "power",
+    "chip_id", "device_id", "chip_name", "health", "temperature", "ai_core_usage",
+    "memory_used", "memory_total", "memory_free",
+)
+
+# 可以用于排序的数值列
+SORT_COLUMNS = ("memory_free", "memory_used", "ai_core_usage", "temperature", "power")
+
+duration_p = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value):
+    """ 解析 "90"、"30m"、"1h"、"2d" 形式的时长，返回秒数 """
+    m = duration_p.match(value)
+    if m is None:
+        raise ValueError(f"无效的时长: {value!r}，示例: 90s、30m、1h、2d")
+    return float(m.group(1)) * DURATION_UNITS[m.group(2)]
+
+
+def parse_time(value):
+    """ query_time 为 datetime.isoformat() 格式的本地时间，转换为时间戳；无法解析时返回 None """
+    for time_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, time_format).timestamp()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class ChipTable:
+    """
+    按列存储的芯片采样数据：每一列为一个 list，同一下标的各列组成一行；
+
+    多个文件解析出的 ChipTable 直接按列拼接，查询时只访问需要的列；
+    """
+
+    def __init__(self, columns=None):
+        self.columns = columns if columns is not None else {name: [] for name in COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["query_time"])
+
+    def extend(self, other):
+        for name, values in self.columns.items():
+            values.extend(other.columns[name])
+        return self
+
+    def append_snapshot(self, snapshot):
+        """ 将一次采样（npustat --json 的输出结构）展开为每个芯片一行 """
+        c = self.columns
+        hostname = snapshot.get("hostname")
+        query_time = parse_time(snapshot.get("query_time"))
+        if query_time is None:
+            return
+        for card in snapshot.get("atlas_cards") or []:
+            for chip in card.get("chips") or []:
+                memory_used = to_number(chip.get("memory_used"), default=None)
+                memory_total = to_number(chip.get("memory_total"), default=None)
+                c["hostname"].append(hostname)
+                c["query_time"].append(query_time)
+                c["card_id"].append(card.get("card_id"))
+                c["card_type"].append(card.get("type"))
+                c["power"].append(to_number(card.get("power"), default=None))
+                c["chip_id"].append(chip.get("chip_id"))
+                c["device_id"].append(chip.get("device_id"))
+                c["chip_name"].append(chip.get("chip_name"))
+                c["health"].append(chip.get("health"))
+                c["temperature"].append(to_number(chip.get("temperature"), default=None))
+                c["ai_core_usage"].append(to_number(chip.get("ai_core_usage"), default=None))
+                c["memory_used"].append(memory_used)
+                c["memory_total"].append(memory_total)
+                c["memory_free"].append(
+                    memory_total - memory_used if memory_used is not None and memory_total is not None else None)
+
+    def row(self, index):
+        return {name: values[index] for name, values in self.columns.items()}
+
+
+def iter_snapshots(data):
+    """
+    解析一个文件中的所有采样记录，支持：
+    * npustat --json 输出的单个快照，以及多次追加写入同一个文件的多个快照；
+    * --format json-compact 持续输出的记录（每行一条）；
+    * --format msgpack 持续输出的记录；
+
+    文件末尾不完整的记录（如正在写入）会被忽略
+    """
+    stripped = data.lstrip()
+    if not stripped:
+        return
+    if stripped[:1] in (b"{", b"["):
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError as e:
+            # 正在写入的文件末尾可能有被截断的多字节字符，只解码到截断处；文件中间的非法字符仍然报错
+            if e.reason != "unexpected end of data":
+                raise
+            text = data[:e.start].decode("utf-8")
+        decoder = json.JSONDecoder()
+        pos, end = 0, len(text)
+        while 1:
+            while pos < end and text[pos].isspace():
+                pos += 1
+            if pos >= end:
+                return
+            try:
+                o, pos = decoder.raw_decode(text, pos)
+            except json.JSONDecodeError:
+                return
+            if isinstance(o, list):
+                yield from (item for item in o if isinstance(item, dict))
+            elif isinstance(o, dict):
+                yield o
+    else:
+        if msgpack is None:
+            raise RuntimeError("读取 msgpack 格式的记录需要先安装 msgpack：pip install msgpack")
+        unpacker = msgpack.Unpacker(raw=False)
+        unpacker.feed(data)
+        for o in unpacker:
+            if isinstance(o, dict):
+                yield o
+
+
+def load_file(path):
+    """ 解析单个文件，返回 (ChipTable 的列, 采样记录数)；在子进程中执行 """
+    with open(path, "rb") as f:
+        data = f.read()
+    table = ChipTable()
+    records = 0
+    for snapshot in iter_snapshots(data):
+        table.append_snapshot(snapshot)
+        records += 1
+    if records == 0 and data.strip():
+        raise ValueError("没有解析到任何采样记录")
+    return table.columns, records
+
+
+def _load_file_safe(path):
+    try:
+        columns, records = load_file(path)
+        return columns, records, None
+    except Exception as e:
+        return None, 0, f"{type(e).__name__}: {e}"
+
+
+def list_files(directory):
+    """ 递归列出目录下所有非隐藏文件，返回 {绝对路径: (mtime_ns, size)} """
+    result = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith("."):
+                continue
+            path = os.path.abspath(os.path.join(root, name))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result[path] = (st.st_mtime_ns, st.st_size)
+    return result
+
+
+def default_index_path(directory):
+    """ 索引默认保存在用户目录下，不写入（可能是共享的）数据目录 """
+    digest = hashlib.sha1(os.path.abspath(directory).encode("utf-8")).hexdigest()[:16]
+    ext = "msgpack" if msgpack is not None else "json"
+    return os.path.join(os.path.expanduser("~"), ".cache", "npustat", f"aggregate-{digest}.{ext}")
+
+
+class SnapshotIndex:
+    """
+    以文件的 mtime 为 key 的增量索引：保存每个文件上一次解析出的列数据，
+    重复运行时只重新解析 mtime（或大小）发生变化的文件，已删除的文件从索引中移除；
+
+    索引中只有标量组成的列表，保存为 msgpack（已安装时）或 json，读取时不会执行任何代码，
+    内容不合法的索引直接丢弃并重新解析全部文件
+    """
+
+    version = 2
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}  # 绝对路径 => (mtime_ns, size, columns, records, error)
+
+    @staticmethod
+    def _check_entry(entry):
+        """ 校验并转换一个文件的索引项，不合法时抛出 ValueError """
+        if not isinstance(entry, list) or len(entry) != 5:
+            raise ValueError("索引项格式错误")
+        mtime_ns, size, columns, records, error = entry
+        if not isinstance(mtime_ns, int) or not isinstance(size, int) or not isinstance(records, int):
+            raise ValueError("索引项格式错误")
+        if columns is not None:
+            if not isinstance(columns, dict) or set(columns) != set(COLUMNS) or \
+                    not all(isinstance(values, list) for values in columns.values()):
+                raise ValueError("索引项中的列格式错误")
+        if error is not None and not isinstance(error, str):
+            raise ValueError("索引项格式错误")
+        return mtime_ns, size, columns, records, error
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            if data.lstrip()[:1] == b"{":
+                o = json.loads(data.decode("utf-8"))
+            elif msgpack is not None:
+                o = msgpack.unpackb(data, raw=False)
+            else:
+                raise ValueError("索引为 msgpack 格式，需要先安装 msgpack")
+            if not isinstance(o, dict) or o.get("version") != self.version or not isinstance(o.get("files"), dict):
+                return self
+            self.files = {path: self._check_entry(entry) for path, entry in o["files"].items()}
+        except Exception as e:
+            self.files = {}
+            sys.stderr.write(f"读取索引 {self.path} 失败，将重新解析全部文件: {e}\n")
+        return self
+
+    def save(self):
+        if self.path is None:
+            return
+        o = {"version": self.version, "files": {path: list(entry) for path, entry in self.files.items()}}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                if msgpack is not None:
+                    f.write(msgpack.packb(o, use_bin_type=True))
+                else:
+                    f.write(json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            sys.stderr.write(f"保存索引 {self.path} 失败: {e}\n")
+
+    def refresh(self, directory, workers=None):
+        """ 扫描目录并更新索引，返回合并之后的 ChipTable 以及本次扫描的统计信息 """
+        current = list_files(directory)
+        changed = [path for path, key in current.items()
+                   if path not in self.files or self.files[path][:2] != key]
+        removed = [path for path in self.files if path not in current]
+        for path in removed:
+            del self.files[path]
+
+        workers = workers or os.cpu_count() or 1
+        if workers > 1 and len(changed) > 1:
+            chunksize = max(1, len(changed) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=min(workers, len(changed))) as executor:
+                results = list(executor.map(_load_file_safe, changed, chunksize=chunksize))
+        else:
+            results = [_load_file_safe(path) for path in changed]
+
+        for path, (columns, records, error) in zip(changed, results):
+            self.files[path] = current[path] + (columns, records, error)
+
+        table = ChipTable()
+        stats = {"files": len(current), "parsed": len(changed), "reused": len(current) - len(changed),
+                 "removed": len(removed), "records": 0, "errors": {}}
+        for path in sorted(current):
+            _, _, columns, records, error = self.files[path]
+            if error is not None:
+                stats["errors"][path] = error
+                continue
+            table.extend(ChipTable(columns))
+            stats["records"] += records
+        return table, stats
+
+
+def latest_chips(table, since=None):
+    """
+    每个节点最近一次快照中各芯片（hostname, card_id, device_id）的行号；since 为时间戳，早于该时间的采样被忽略；
+
+    只使用每个节点最近一次的快照，在较新的快照中已经消失的加速卡、芯片不会再出现在结果中
+    """
+    c = table.columns
+    hostnames, card_ids, device_ids, query_times = c["hostname"], c["card_id"], c["device_id"], c["query_time"]
+    host_latest = {}  # hostname => 该节点最近一次快照的时间
+    for hostname, t in zip(hostnames, query_times):
+        if since is not None and t < since:
+            continue
+        if t > host_latest.get(hostname, t - 1):
+            host_latest[hostname] = t
+
+    latest = {}
+    for i in range(len(table)):
+        if query_times[i] == host_latest.get(hostnames[i]):
+            latest[(hostnames[i], card_ids[i], device_ids[i])] = i
+    return latest
+
+
+def top_chips(table, n=None, by="memory_free", since=None):
+    """ 按照每个节点最近一次快照中芯片 by 列的值从大到小排序，返回前 n 个芯片的行号；没有 by 的芯片排在最后 """
+    values = table.columns[by]
+    indices = list(latest_chips(table, since).values())
+    indices.sort(key=lambda i: (values[i] is not None, values[i] if values[i] is not None else 0.0), reverse=True)
+    return indices[:n] if n is not None else indices
+
+
+def chips_in_order(table, since=None):
+    """ 按 hostname、card_id、device_id 排序的每个节点最近一次快照中各芯片的行号 """
+    latest = latest_chips(table, since)
+    return [latest[key] for key in sorted(latest, key=lambda k: tuple(str(v) for v in k))]
+
+
+def unhealthy_cards(table, since=None):
+    """
+    since 之后出现过 Health 不为 OK 的芯片的加速卡，按最近一次异常的时间倒序排列；
+    返回 [{"hostname", "card_id", "card_type", "device_ids", "health", "samples", "first_time", "last_time"}, ...]
+    """
+    c = table.columns
+    result = {}
+    for i, health in enumerate(c["health"]):
+        if health == "OK" or health is None:
+            continue
+        t = c["query_time"][i]
+        if since is not None and t < since:
+            continue
+        key = (c["hostname"][i], c["card_id"][i])
+        card = result.get(key)
+        if card is None:
+            card = {"hostname": key[0], "card_id": key[1], "card_type": c["card_type"][i], "device_ids": set(),
+                    "health": set(), "samples": 0, "first_time": t, "last_time": t}
+            result[key] = card
+        card["device_ids"].add(c["device_id"][i])
+        card["health"].add(health)
+        card["samples"] += 1
+        card["first_time"] = min(card["first_time"], t)
+        card["last_time"] = max(card["last_time"], t)
+
+    cards = sorted(result.values(), key=lambda card: card["last_time"], reverse=True)
+    for card in cards:
+        card["device_ids"] = sorted(card["device_ids"], key=str)
+        card["health"] = sorted(card["health"])
+        card["first_time"] = datetime.fromtimestamp(card["first_time"]).isoformat()
+        card["last_time"] = datetime.fromtimestamp(card["last_time"]).isoformat()
+    return cards
+
+
+def chip_records(table, indices):
+    records = []
+    for i in indices:
+        row = table.row(i)
+        row["query_time"] = datetime.fromtimestamp(row["query_time"]).isoformat()
+        records.append(row)
+    return records
+
+
+def print_json(result, fp=sys.stdout):
+    json.dump(result, fp, indent=4, separators=(",", ": "), ensure_ascii=False)
+    fp.write("\n")
+    fp.flush()
+
+
+def _fmt(value, fmt="{:.0f}"):
+    if value is None:
+        return "??"
+    return fmt.format(value) if isinstance(value, float) else str(value)
+
+
+def print_chip_table(records, fp=sys.stdout):
+    header = ("hostname", "card", "device", "chip_name", "health", "temp", "aicore", "mem_used", "mem_total",
+              "mem_free", "query_time")
+    rows = [(r["hostname"], r["card_id"], r["device_id"], r["chip_name"], r["health"], r["temperature"],
+             r["ai_core_usage"], r["memory_used"], r["memory_total"], r["memory_free"], r["query_time"])
+            for r in records]
+    _print_rows(header, rows, fp)
+
+
+def print_card_table(cards, fp=sys.stdout):
+    header = ("hostname", "card", "type", "devices", "health", "samples", "first_time", "last_time")
+    rows = [(c["hostname"], c["card_id"], c["card_type"], ",".join(str(d) for d in c["device_ids"]),
+             ",".join(c["health"]), c["samples"], c["first_time"], c["last_time"]) for c in cards]
+    _print_rows(header, rows, fp)
+
+
+def _print_rows(header, rows, fp):
+    rows = [[_fmt(v) for v in row] for row in rows]
+    widths = [max([len(h)] + [len(row[i]) for row in rows]) for i, h in enumerate(header)]
+    fp.write("  ".join(f"{h:<{w}}" for h, w in zip(header, widths)).rstrip() + "\n")
+    for row in rows:
+        fp.write("  ".join(f"{v:<{w}}" for v, w in zip(row, widths)).rstrip() + "\n")
+    fp.flush()
@@ -7,6 +7,18 @@ import os
 
 class GetCardStatusWithAscendDmi:
 
+    def __init__(self, card_ids=None, device_ids=None):
+        # 选中的加速卡ID、DeviceID（字符串集合），为 None 时表示全部选中
+        self.card_ids = card_ids
+        self.device_ids = device_ids
+
+    def is_selected(self, card_id, device_id=None):
+        if self.card_ids is not None and str(card_id) not in self.card_ids:
+            return False
+        if device_id is not None and self.device_ids is not None and str(device_id) not in self.device_ids:
+            return False
+        return True
+
     def new_query(self):
         version = self.get_version()
         card_entry_list = self.get_card_entry()
@@ -17,27 +29,30 @@ class GetCardStatusWithAscendDmi:
         return os.popen(cmd).read().strip()
 
     def devices_to_cards(self, server_type, devices):
-        cards = []
-        lastone = lambda : {"type": server_type} if len(cards) == 0 else cards[-1]
+        """
+        将 server 下平铺的芯片列表按 card_id 分组为加速卡；单次遍历，同时累加每张卡的实时功率；
+        未选中的芯片直接跳过，指定了 --device 时加速卡的功率只包含选中的芯片；
+        任一选中芯片的功率缺失或无法解析时，该加速卡的功率为 None（未知），不会只累加其余芯片的功率
+        """
+        cards = {}
         for device in devices:
-            card = lastone()
-            card_id = card.get("card_id")
-            if card_id is None:
-                card["card_id"] = device["card_id"]
-                chips = [device]
-                card["devices"] = chips
-                cards.append(card)
-            elif card_id == device["card_id"]:
-                chips = card["devices"]
-                chips.append(device)
-                card["devices"] = chips
-                card["power"] = self.get_card_power(card)
+            if not self.is_selected(device["card_id"], device["device_id"]):
+                continue
+            card = cards.get(device["card_id"])
+            if card is None:
+                card = {"type": server_type, "card_id": device["card_id"], "devices": [], "power": 0.0}
+                cards[device["card_id"]] = card
+            card["devices"].append(device)
+            power = self.parse_power(device.get("power_information", {}).get("realtime_power"))
+            if power is None or card["power"] is None:
+                card["power"] = None
             else:
-                card = {"type": server_type,
-                        "card_id": device["card_id"],
-                        "devices": [device]}
-                cards.append(card)
-        return cards
+                card["power"] += power
+
+        for card in cards.values():
+            if card["power"] is not None:
+                card["power"] = round(card["power"], 2)
+        return list(cards.values())
 
     def get_card_entry(self):
         cmd = "ascend-dmi -i --format json"  # 使用Ascend-DMI做实时信息统计
@@ -61,13 +76,20 @@ class GetCardStatusWithAscendDmi:
                 return card_entry_list
             cards = self.devices_to_cards(server_type, devices)
         for card_info in cards:
+            if not self.is_selected(card_info["card_id"]):
+                continue
+            chip_infos = [chip_info for chip_info in card_info["devices"]
+                          if self.is_selected(card_info["card_id"], chip_info["device_id"])]
+            if not chip_infos:
+                continue
+
             card_entry = dict()
             card_entry["card_id"] = card_info["card_id"]
             card_entry["type"] = card_info["type"]
-            card_entry["power"] = self.get_power(card_info["power"])
+            card_entry["power"] = self.parse_power(card_info.get("power"))
 
             chip_entry_list = []
-            for chip_info in card_info["devices"]:
+            for chip_info in chip_infos:
                 chip_entry = dict()
                 chip_entry["chip_id"] = chip_info["chip_id"]
                 chip_entry["device_id"] = chip_info["device_id"]
@@ -98,25 +120,15 @@ class GetCardStatusWithAscendDmi:
         return temp
 
     def parse_power(self, pw):
-        power = 0.0
-        pw = pw.strip()
+        """ 将 "16.30 W"、"16.30" 或数值统一转换为以瓦为单位的 float，缺失或无法解析时返回 None """
+        if pw is None:
+            return None
+        if isinstance(pw, (int, float)):
+            return float(pw)
+        pw = str(pw).strip()
         if pw.endswith("W"):
             pw = pw[:-1].strip()
-            try:
-                power = float(pw)
-            except Exception:
-                return power
-            return power
-
-    def get_power(self, power):
-        power = self.parse_power(power)
-        return f"{power:.2f} W"
-
-    def get_card_power(self, card):
-        chips = card.get("devices", {})
-        power = 0.0
-        for chip in chips:
-            power += self.parse_power(
-                chip.get("power_information", {}).get(
-                    "realtime_power", "0.00 W"))
-        return f"{power:.2f} W"
+        try:
+            return float(pw)
+        except ValueError:
+            return None
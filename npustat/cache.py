@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class _InflightCall:
+    """ 正在进行中的一次查询，其他线程等待它完成后共享结果 """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    """
+    线程安全的查询缓存，用于在多线程程序中调用 new_query；
+
+    * TTL：ttl 秒内的重复查询直接返回缓存的结果，不会再调用 npu-smi / ascend-dmi；
+    * single-flight：缓存失效时，多个线程同时查询同一个 key，只有一个线程真正执行查询，其他线程等待并共享其结果；
+    * 查询出错时不缓存，等待中的线程会收到同一个异常；
+
+    缓存的是后端返回的原始数据，调用方之间共享，不应被修改；
+    """
+
+    def __init__(self, ttl=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = {}  # key => (过期时间, value)
+        self._inflight = {}  # key => _InflightCall
+
+        self.hits = 0  # 直接命中缓存
+        self.shared = 0  # 等待其他线程正在进行中的查询
+        self.misses = 0  # 真正执行了查询
+
+    def get(self, key, query_fn):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.hits += 1
+                return entry[1]
+
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InflightCall()
+                self._inflight[key] = call
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = query_fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if call.error is None:
+                    self._entries[key] = (self.clock() + self.ttl, call.value)
+                del self._inflight[key]
+            call.done.set()
+        return call.value
+
+    def invalidate(self, key=None):
+        """ 使指定 key 的缓存失效，key 为 None 时清空全部缓存；不影响正在进行中的查询 """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared": self.shared,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "inflight": len(self._inflight),
+            }
@@ -5,10 +5,21 @@ import argparse
 import os
 import sys
 import time
+import traceback
+from datetime import datetime
 
 from blessed import Terminal
 
-from .core import new_query
+from . import aggregate
+from .core import new_query, query_backend, update_collection
+from .energy import EnergyMeter
+from .events import EventDetector
+from .metrics import METRIC_GROUPS, parse_metric_groups
+from .sampler import Sampler
+from .scheduler import AdaptiveInterval
+from .serialize import FORMATS, SnapshotEncoder
+from .stats import SessionStats
+from .view import WatchView
 from npustat import __version__
 
 
@@ -28,58 +39,375 @@ def check_npu_smi():
         exit(1)
 
 
-def print_atlas_stat(has_ascend_dmi, json=False, debug=False, *args, **kwargs):
+def parse_id_list(value):
+    """ 解析 "0,1,3" 形式的ID列表，返回字符串集合 """
+    ids = set(v.strip() for v in value.split(",") if v.strip())
+    if not ids:
+        raise argparse.ArgumentTypeError(f"无效的ID列表: {value!r}")
+    return ids
+
+
+def parse_metrics(value):
+    try:
+        return parse_metric_groups(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def report_query_error(e, debug=False):
+    """ 打印查询出错时的提示信息并退出 """
+    sys.stderr.write("获取 Atlas 设备信息报错。请在参数中添加上 \"--debug\" 获取报错的详情信息；"
+                     "并将报错信息反馈到：https://github.com/wmc1992/atlas-stat\n")
+    if debug:
+        try:
+            import traceback
+            traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+        except Exception:
+            raise e
+    sys.exit(1)
+
+
+def query_atlas_stat(has_ascend_dmi, debug=False, *args, **kwargs):
     """
-    Display the Atlas query results into standard output.
+    Query the Atlas status; print the error message and exit when failed.
     """
     try:
-        atlas_stat = new_query(has_ascend_dmi=has_ascend_dmi, *args, **kwargs)
+        return new_query(has_ascend_dmi=has_ascend_dmi, *args, **kwargs)
     except Exception as e:
-        sys.stderr.write("获取 Atlas 设备信息报错。请在参数中添加上 \"--debug\" 获取报错的详情信息；"
-                         "并将报错信息反馈到：https://github.com/wmc1992/atlas-stat\n")
-        if debug:
-            try:
-                import traceback
-                traceback.print_exc(file=sys.stderr)
-            except Exception:
-                raise e
-        sys.exit(1)
+        report_query_error(e, debug)
 
-    if json:
-        atlas_stat.print_json(sys.stdout)
+
+def print_atlas_stat(has_ascend_dmi, json=False, debug=False, output_format=None, encoder=None, *args, **kwargs):
+    """
+    Display the Atlas query results into standard output.
+    """
+    atlas_stat = query_atlas_stat(has_ascend_dmi=has_ascend_dmi, debug=debug, *args, **kwargs)
+
+    if json and output_format is None:
+        output_format = "json"
+    if output_format is not None:
+        if encoder is None:
+            encoder = SnapshotEncoder(output_format)
+        atlas_stat.print_encoded(sys.stdout, encoder)
     else:
         atlas_stat.print_formatted(sys.stdout, **kwargs)
 
 
-def loop_atlas_stat(has_ascend_dmi, interval=1.0, *args, **kwargs):
-    term = Terminal()
+def render_atlas_stat(term, atlas_stat, view, session_stats=None):
+    """ 按照 watch 模式下当前的展示状态，使用已经获取到的数据重新渲染整个屏幕 """
+    # Move cursor to (0, 0) but do not restore original cursor loc
+    print(term.move(0, 0), end="")
+    if atlas_stat is None:
+        sys.stdout.write("正在获取 Atlas 设备信息..." + term.clear_eol + os.linesep)
+    else:
+        view.apply(atlas_stat)
+        atlas_stat.print_formatted(sys.stdout, rows=view.arrange(atlas_stat))
+        if session_stats is not None:
+            sys.stdout.write(session_stats.footer() + atlas_stat.eol_char)
+        age = time.time() - atlas_stat.query_time.timestamp()
+        interval = atlas_stat.sampling["interval"] if atlas_stat.sampling is not None else None
+        sys.stdout.write(term.bold_black + view.status_line(age=age, interval=interval) + term.normal +
+                         atlas_stat.eol_char)
+    print(term.clear_eos, end="", flush=True)
+
+
+def make_scheduler(interval, max_cpu_share):
+    """ max_cpu_share 为单核 CPU 的百分比，小于等于0时不调整采样间隔 """
+    if not max_cpu_share or max_cpu_share <= 0:
+        return None
+    return AdaptiveInterval(interval, max_cpu_share=max_cpu_share / 100.0)
+
+
+def print_session_stats(session_stats, stats_format, fp):
+    """ 退出时输出整个会话的统计信息 """
+    if session_stats is None or session_stats.samples == 0:
+        return
+    if stats_format == "json":
+        session_stats.print_json(fp)
+    else:
+        session_stats.print_table(fp)
 
-    with term.fullscreen():
+
+def sample_atlas_stat(has_ascend_dmi, interval, card_ids=None, device_ids=None, metrics=None, max_cpu_share=10.0,
+                      timeout=1.0, stop_on_error=True, *args, **kwargs):
+    """
+    长时间运行模式共用的采样循环：后台 Sampler 按 INTERVAL（或自适应的有效间隔）查询，前台复用同一个 AtlasCardCollection；
+
+    生成 (atlas_stat, error)：有新的采样时 atlas_stat 为更新之后的对象；timeout 秒内没有新结果时为 (None, None)；
+    查询出错时为 (None, error)，stop_on_error 为 True 时随后结束，否则继续采样；
+    """
+    # 后台线程只负责查询，前台线程复用同一个 AtlasCardCollection 对象
+    def query_fn():
+        return query_backend(has_ascend_dmi, card_ids, device_ids, metrics)
+
+    scheduler = make_scheduler(interval, max_cpu_share)
+    seq, atlas_stat = 0, None
+    with Sampler(query_fn, interval, scheduler, stop_on_error=stop_on_error) as sampler:
         while 1:
-            try:
-                query_start = time.time()
+            latest_seq, latest, error = sampler.get(after_seq=seq, timeout=timeout)
+            if latest_seq <= seq:
+                yield None, None
+                continue
+            seq = latest_seq
+            if error is not None:
+                yield None, error
+                if stop_on_error:
+                    return
+                continue
+            atlas_stat = update_collection(atlas_stat, latest, *args, **kwargs)
+            if scheduler is not None:
+                atlas_stat.sampling = scheduler.snapshot()
+            yield atlas_stat, None
+
+
+def loop_atlas_stat(has_ascend_dmi, interval=1.0, compact=False, show_power=True, debug=False, stats_format=None,
+                    *args, **kwargs):
+    term = Terminal()
+    eol_char = term.clear_eol + os.linesep
+    view = WatchView(compact=compact, show_power=show_power, can_show_power=has_ascend_dmi)
+    energy_meter = EnergyMeter()
+    session_stats = SessionStats() if stats_format is not None else None
+
+    # 采样在后台线程中进行；前台按固定节奏渲染（用于刷新采样时间），有新的采样或按键时立即渲染
+    render_interval = min(interval, 1.0)
+    poll_interval = min(interval, 0.1)
+
+    # 不等待新的采样（timeout=0），前台在 inkey 中等待按键
+    samples = sample_atlas_stat(has_ascend_dmi, interval, timeout=0, term=term, eol_char=eol_char, compact=compact,
+                                show_power=show_power, *args, **kwargs)
+    atlas_stat, error, next_render_time = None, None, 0.0
+    with term.fullscreen(), term.cbreak(), term.hidden_cursor():
+        try:
+            for latest, error in samples:
+                if error is not None:
+                    break
+
+                dirty = False
+                if latest is not None:
+                    atlas_stat = latest
+                    energy_meter.update(atlas_stat)
+                    if session_stats is not None:
+                        session_stats.update(atlas_stat)
+                    dirty = True
+                if dirty or time.time() >= next_render_time:
+                    render_atlas_stat(term, atlas_stat, view, session_stats)
+                    next_render_time = time.time() + render_interval
 
-                # Move cursor to (0, 0) but do not restore original cursor loc
-                print(term.move(0, 0), end="")
-                print_atlas_stat(has_ascend_dmi=has_ascend_dmi, eol_char=term.clear_eol + os.linesep, *args, **kwargs)
-                print(term.clear_eos, end="")
+                # 按键只基于已有数据重新渲染，不会触发查询
+                key = term.inkey(timeout=poll_interval)
+                if key == "q":
+                    break
+                if key and atlas_stat is not None and view.handle_key(key, atlas_stat):
+                    render_atlas_stat(term, atlas_stat, view, session_stats)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            samples.close()
 
-                query_duration = time.time() - query_start
-                sleep_duration = interval - query_duration
-                if sleep_duration > 0:
-                    time.sleep(sleep_duration)
-            except KeyboardInterrupt:
-                return 0
+    print_session_stats(session_stats, stats_format, sys.stdout)
+    if error is not None:
+        report_query_error(error, debug)
+    return 0
+
+
+def stream_atlas_stat(has_ascend_dmi, output_format, interval=1.0, json=False, debug=False, stats_format=None,
+                      *args, **kwargs):
+    """ 长时间运行模式下按 INTERVAL 持续输出编码后的记录，多次采样之间复用同一个 encoder """
+    encoder = SnapshotEncoder(output_format)
+    energy_meter = EnergyMeter()
+    session_stats = SessionStats() if stats_format is not None else None
+
+    samples = sample_atlas_stat(has_ascend_dmi, interval, *args, **kwargs)
+    error = None
+    try:
+        for atlas_stat, error in samples:
+            if error is not None:
+                break
+            if atlas_stat is not None:
+                energy_meter.update(atlas_stat)
+                if session_stats is not None:
+                    session_stats.update(atlas_stat)
+                atlas_stat.print_encoded(sys.stdout, encoder)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        samples.close()
+
+    # stdout 为编码后的数据流，统计信息输出到 stderr
+    print_session_stats(session_stats, stats_format, sys.stderr)
+    if error is not None:
+        report_query_error(error, debug)
+    return 0
+
+
+def events_atlas_stat(has_ascend_dmi, interval=2.0, output_format=None, debug=False, temp_threshold=80,
+                      memory_threshold=90.0, temp_hysteresis=5, memory_hysteresis=5.0, event_confirm=1,
+                      *args, **kwargs):
+    """
+    在同一个进程内比较前后两次采样，只在状态发生变化时输出事件，每个事件一条记录；
+
+    查询出错（如芯片掉卡时 npu-smi / ascend-dmi 返回异常）时输出一条 error 事件并继续采样，不会退出
+    """
+    encoder = SnapshotEncoder(output_format or "json-compact")
+    detector = EventDetector(temp_threshold=temp_threshold, memory_threshold=memory_threshold,
+                             temp_hysteresis=temp_hysteresis, memory_hysteresis=memory_hysteresis,
+                             confirm=event_confirm)
+    buffer = getattr(sys.stdout, "buffer", sys.stdout)
+
+    def _write(events):
+        buffer.write(b"".join(encoder.encode_record(event) for event in events))
+        buffer.flush()
+
+    samples = sample_atlas_stat(has_ascend_dmi, interval, stop_on_error=False, *args, **kwargs)
+    try:
+        for atlas_stat, error in samples:
+            if error is not None:
+                event = {"event": "error", "error": f"{type(error).__name__}: {error}",
+                         "time": datetime.now().isoformat()}
+                if debug:
+                    event["traceback"] = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+                _write([event])
+            elif atlas_stat is not None:
+                events = detector.update(atlas_stat)
+                if events:
+                    _write(events)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        samples.close()
+    return 0
+
+
+def parse_duration(value):
+    try:
+        return aggregate.parse_duration(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def aggregate_main(argv):
+    """ npustat aggregate DIR：汇总多个节点写入到同一个目录下的快照文件、持续输出的记录 """
+    parser = argparse.ArgumentParser(prog="npustat aggregate")
+    parser.add_argument("directory", metavar="DIR",
+                        help="快照文件所在目录，会递归读取其中所有非隐藏文件；每个文件可以是 npustat --json 的输出，"
+                             "也可以是 --format json-compact / msgpack 持续输出的记录；")
+
+    parser.add_argument("--top", dest="top", type=int, default=None,
+                        help="只展示排序之后的前 TOP 个芯片，如 \"--top 20\"；")
+
+    parser.add_argument("--sort", dest="sort_by", choices=aggregate.SORT_COLUMNS, default="memory_free",
+                        help="与 \"--top\" 同时使用，按照每个节点最近一次快照中芯片该字段的值从大到小排序；默认为 memory_free；")
+
+    parser.add_argument("--unhealthy", dest="unhealthy", action="store_true", default=False,
+                        help="列出出现过 Health 不为 OK 的芯片的加速卡，通常与 \"--since\" 同时使用；")
+
+    parser.add_argument("--since", dest="since", type=parse_duration, default=None,
+                        help="只使用最近一段时间内的采样，如 \"--since 1h\"；单位可以为 s/m/h/d，默认为秒；")
+
+    parser.add_argument("--json", dest="json", action="store_true", default=False,
+                        help="将结果输出为JSON格式；")
+
+    parser.add_argument("--workers", dest="workers", type=int, default=None,
+                        help="解析文件使用的进程数，默认为CPU核数；")
+
+    parser.add_argument("--index", dest="index_path", default=None,
+                        help="增量索引文件的路径，默认保存在 ~/.cache/npustat 下；重复运行时只重新解析 mtime 发生变化的文件；")
+
+    parser.add_argument("--no-index", dest="no_index", action="store_true", default=False,
+                        help="不读取、不保存增量索引，每次都解析全部文件；")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        sys.stderr.write(f"Error: 目录 {args.directory} 不存在\n")
+        sys.exit(1)
+
+    index_path = None if args.no_index else (args.index_path or aggregate.default_index_path(args.directory))
+    index = aggregate.SnapshotIndex(index_path).load()
+    table, stats = index.refresh(args.directory, workers=args.workers)
+    index.save()
+
+    for path, error in stats["errors"].items():
+        sys.stderr.write(f"解析文件 {path} 失败: {error}\n")
+    sys.stderr.write(f"共 {stats['files']} 个文件（解析 {stats['parsed']} 个，索引中复用 {stats['reused']} 个），"
+                     f"{stats['records']} 次采样，{len(table)} 行\n")
+
+    since = time.time() - args.since if args.since is not None else None
+    if args.unhealthy:
+        result = aggregate.unhealthy_cards(table, since)
+        print_fn = aggregate.print_card_table
+    else:
+        if args.top is not None:
+            indices = aggregate.top_chips(table, args.top, by=args.sort_by, since=since)
+        else:
+            indices = aggregate.chips_in_order(table, since)
+        result = aggregate.chip_records(table, indices)
+        print_fn = aggregate.print_chip_table
+
+    if args.json:
+        aggregate.print_json(result, sys.stdout)
+    else:
+        print_fn(result, sys.stdout)
+    return 0
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "aggregate":
+        return aggregate_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--json", action="store_true", default=False,
-                        help="将所有结果输出为JSON格式；")
+                        help="将所有结果输出为JSON格式；等价于 \"--format json\"；")
+
+    parser.add_argument("--format", dest="output_format", choices=FORMATS, default=None,
+                        help="输出格式；json 与 --json 相同；json-compact 为不带缩进的单行json，安装了 orjson 时使用"
+                             " orjson 编码；msgpack 需要安装 msgpack；json-compact 和 msgpack 可以与 --watch 同时使用，"
+                             "每次采样输出一条记录；")
+
+    parser.add_argument("--events", action="store_true", default=False,
+                        help="事件模式：持续采样，只在芯片 Health 变化、温度/内存使用率越过阈值、加速卡或芯片消失时输出一条记录；"
+                             "记录格式由 \"--format\" 指定，默认为 json-compact；未指定 INTERVAL 时每2秒采样一次；")
+
+    parser.add_argument("--temp-threshold", dest="temp_threshold", type=float, default=80,
+                        help="事件模式下温度的阈值，单位：°C；默认为80；")
+
+    parser.add_argument("--memory-threshold", dest="memory_threshold", type=float, default=90.0,
+                        help="事件模式下内存使用率的阈值，单位：%%；默认为90；")
+
+    parser.add_argument("--temp-hysteresis", dest="temp_hysteresis", type=float, default=5,
+                        help="事件模式下温度的回差，温度回落到 阈值-回差 以下才认为恢复正常；默认为5；")
+
+    parser.add_argument("--memory-hysteresis", dest="memory_hysteresis", type=float, default=5.0,
+                        help="事件模式下内存使用率的回差，内存使用率回落到 阈值-回差 以下才认为恢复正常；默认为5；")
+
+    parser.add_argument("--event-confirm", dest="event_confirm", type=int, default=1,
+                        help="事件模式下新的状态需要连续出现的次数，用于进一步避免状态反复跳变；默认为1；")
 
     parser.add_argument("-i", "--interval", "--watch", nargs="?", type=float, default=0,
                         help="动态刷新模式；INTERVAL为刷新间隔，单位：秒；默认每2秒刷新一次；")
 
+    parser.add_argument("--max-cpu-share", dest="max_cpu_share", type=float, default=10.0,
+                        help="watch 模式、持续输出模式及事件模式下，查询最多占用单核 CPU 的百分比；查询的 CPU 开销按整个"
+                             " npustat 进程（包括 --metrics 的线程池以及查询期间的渲染）及 npu-smi / ascend-dmi 子进程统计；"
+                             "查询开销变大时自动增大采样间隔，开销变小时恢复；有效间隔展示在 header 及 json 的"
+                             " sampling 字段中；默认为10，设置为0时不调整采样间隔；")
+
+    parser.add_argument("--stats", dest="stats_format", choices=("table", "json"), default=None,
+                        help="watch 模式及持续输出模式下统计每个芯片 AICore、温度、内存的 min/mean/max/p50/p95/p99，"
+                             "watch 模式下在底部展示，退出时按指定格式输出整个会话的统计结果；")
+
+    parser.add_argument("--id", dest="card_ids", type=parse_id_list, default=None,
+                        help="只查询指定的加速卡，多个加速卡ID之间使用逗号分隔，如 \"--id 0,2\"；"
+                             "未选中的加速卡在查询、解析阶段就会被跳过；")
+
+    parser.add_argument("--device", dest="device_ids", type=parse_id_list, default=None,
+                        help="只查询指定 DeviceID 的芯片，多个 DeviceID 之间使用逗号分隔，如 \"--device 0,1\"；"
+                             "可以与 \"--id\" 同时使用；")
+
+    parser.add_argument("--metrics", dest="metrics", type=parse_metrics, default=None,
+                        help="开启扩展指标，多个指标组之间使用逗号分隔，如 \"--metrics hbm,aicpu\"；"
+                             f"可选值为: {', '.join(METRIC_GROUPS)}；"
+                             "每个芯片会通过 npu-smi 并发查询，未开启的指标组不会有任何额外开销；")
+
     parser.add_argument("--no-header", dest="no_header", action="store_true", default=False,
                         help="是否隐藏 header 信息；header 信息包含机器名称、当前时间、版本号；"
                              "默认展示 header 信息，配置该参数后 header 信息不再展示；")
@@ -98,7 +426,8 @@ def main():
 
     parser.add_argument("--compact", dest="compact", action="store_true", default=False,
                         help="是否采用紧凑模式展示信息，默认为不采用；"
-                             "紧凑模式下会去掉空白行及其他无意义的行，适用于加速卡较多，显示器较小，屏幕显示不下的情况；")
+                             "紧凑模式下会去掉空白行及其他无意义的行，适用于加速卡较多，显示器较小，屏幕显示不下的情况；"
+                             "watch 模式下可以按 c 键切换；")
 
     parser.add_argument("--debug", action="store_true", default=False,
                         help="Debug模式时允许在程序出错的情况下打印更多的调试信息；")
@@ -120,19 +449,36 @@ def main():
     if not has_ascend_dmi:
         check_npu_smi()
 
-    if args.compact:
-        args.no_header = True
-        args.no_title = True
+    if args.output_format is not None:
+        try:
+            SnapshotEncoder(args.output_format)
+        except RuntimeError as e:
+            sys.stderr.write(f"Error: {e}\n")
+            sys.exit(1)
 
     if args.interval is None:  # with default value
         args.interval = 2.0  # 默认每2秒刷新一次
+
+    if args.events:
+        if args.json or args.stats_format is not None:
+            sys.stderr.write("Error: \"--events\" 不能与 \"--json\"、\"--stats\" 同时使用；"
+                             "事件记录的格式使用 \"--format json-compact\" 或 \"--format msgpack\" 指定；\n")
+            sys.exit(1)
+        args.interval = max(0.1, args.interval or 2.0)
+        events_atlas_stat(**vars(args), has_ascend_dmi=has_ascend_dmi)
+        return
+
     if args.interval > 0:
         args.interval = max(0.1, args.interval)
-        if args.json:
-            sys.stderr.write("Error: \"--json\" 和 \"-i/--interval/--watch\" 不能同时使用；\n")
+        if args.json or args.output_format == "json":
+            sys.stderr.write("Error: \"--json\" 和 \"-i/--interval/--watch\" 不能同时使用；"
+                             "可以使用 \"--format json-compact\" 或 \"--format msgpack\"；\n")
             sys.exit(1)
 
-        loop_atlas_stat(**vars(args), has_ascend_dmi=has_ascend_dmi)
+        if args.output_format is not None:
+            stream_atlas_stat(**vars(args), has_ascend_dmi=has_ascend_dmi)
+        else:
+            loop_atlas_stat(**vars(args), has_ascend_dmi=has_ascend_dmi)
     else:
         del args.interval
         print_atlas_stat(**vars(args), has_ascend_dmi=has_ascend_dmi)
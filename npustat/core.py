@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import json
 import locale
 import os
 import platform
@@ -12,7 +11,10 @@ from blessed import Terminal
 from six.moves import cStringIO as StringIO
 
 from .ascend_dmi import GetCardStatusWithAscendDmi
+from .energy import JOULES_PER_KWH
+from .metrics import DISPLAY_FORMATS, collect_extended_metrics
 from .npu_smi import GetCardStatusWithNpuSmi
+from .serialize import SnapshotEncoder
 
 IS_WINDOWS = "windows" in platform.platform().lower()
 
@@ -20,6 +22,16 @@ IS_WINDOWS = "windows" in platform.platform().lower()
 class Chip:
     """ 每个Atlas加速卡中会有多个芯片，该类表示每个芯片的信息 """
 
+    # build one-line display information
+    template = ""
+    template += "%(C1)s[{entry[chip_id]}]%(C0)s" + " "
+    template += "%(C1)s[{entry[device_id]:>{device_id_width}}]%(C0)s" + " "
+    template += "%(ChipHealth)s{entry[health]}%(C0)s" + ", "
+    template += "%(ChipName)s{entry[chip_name]:{chip_name_width}}%(C0)s" + " |"
+    template += "%(ChipTemp)s{entry[temperature]:>3}°C%(C0)s" + ", "
+    template += "%(ChipAICore)s{entry[ai_core_usage]:>3} %%%(C0)s, "
+    template += "%(C1)s%(ChipMemU)s{entry[memory_used]:>5}%(C0)s" + " / " + "%(ChipMemT)s{entry[memory_total]:>5}%(C0)s"
+
     def __init__(self, entry, term, *args, **kwargs):
         if not isinstance(entry, dict):
             raise TypeError("entry should be a dict, {} given".format(type(entry)))
@@ -27,6 +39,9 @@ class Chip:
 
         self.term = term
 
+        # 填充好颜色之后的模板，按颜色条件缓存，最多 3 ** 3 种；长时间运行模式下对象会被复用，模板只需要生成一次
+        self._formats = {}
+
     def __repr__(self):
         return self.print_to(StringIO()).getvalue()
 
@@ -68,6 +83,27 @@ class Chip:
     def memory_total(self):
         return self.entry["memory_total"]
 
+    # 以下为通过 --metrics 开启的扩展指标，未开启时为 None
+    @property
+    def aicpu_usage(self):
+        return self.entry.get("aicpu_usage")
+
+    @property
+    def ctrl_cpu_usage(self):
+        return self.entry.get("ctrl_cpu_usage")
+
+    @property
+    def hbm_bandwidth_usage(self):
+        return self.entry.get("hbm_bandwidth_usage")
+
+    @property
+    def ddr_bandwidth_usage(self):
+        return self.entry.get("ddr_bandwidth_usage")
+
+    @property
+    def voltage(self):
+        return self.entry.get("voltage")
+
     def get_color(self):
         def _conditional(cond_fn, true_value, false_value, error_value=self.term.bold_black):
             try:
@@ -87,26 +123,35 @@ class Chip:
         colors["ChipAICore"] = _conditional(lambda: self.ai_core_usage < 50, self.term.green, self.term.bold_green)
         return colors
 
-    def print_to(self, fp, chip_name_width=16, device_id_width=1, *args, **kwargs):
-        colors = self.get_color()
-
-        # build one-line display information
-        reps = ""
-        reps += "%(C1)s[{entry[chip_id]}]%(C0)s" + " "
-        reps += "%(C1)s[{entry[device_id]:>{device_id_width}}]%(C0)s" + " "
-        reps += "%(ChipHealth)s{entry[health]}%(C0)s" + ", "
-        reps += "%(ChipName)s{entry[chip_name]:{chip_name_width}}%(C0)s" + " |"
-        reps += "%(ChipTemp)s{entry[temperature]:>3}°C%(C0)s" + ", "
-        reps += "%(ChipAICore)s{entry[ai_core_usage]:>3} %%%(C0)s, "
-        reps += "%(C1)s%(ChipMemU)s{entry[memory_used]:>5}%(C0)s" + " / " + "%(ChipMemT)s{entry[memory_total]:>5}%(C0)s"
+    def get_format(self):
+        """ 返回填充好颜色的模板；颜色只取决于温度、Health、AICore 三个条件，按条件的取值缓存 """
+        def _condition(cond_fn):
+            try:
+                return bool(cond_fn())
+            except Exception:
+                return None
 
+        key = (_condition(lambda: self.temperature < 60),
+               _condition(lambda: self.health == "OK"),
+               _condition(lambda: self.ai_core_usage < 50))
+        reps = self._formats.get(key)
+        if reps is None:
+            reps = self.template % self.get_color()
+            self._formats[key] = reps
+        return reps
+
+    def print_to(self, fp, chip_name_width=16, device_id_width=1, *args, **kwargs):
         def _repr(v, none_value="??"):
             return none_value if v is None else v
 
-        reps = reps % colors
+        reps = self.get_format()
         reps = reps.format(entry={k: _repr(v) for k, v in self.entry.items()},
                            chip_name_width=chip_name_width, device_id_width=device_id_width)
         fp.write(reps)
+
+        for field, _, field_format in DISPLAY_FORMATS:
+            if field in self.entry:
+                fp.write(", " + field_format.format(_repr(self.entry[field])))
         return fp
 
     def get_print_len(self, chip_name_width=16, device_id_width=1):
@@ -118,6 +163,10 @@ class Chip:
                     len(str(self.temperature)) + len("°C") + len(", ") + \
                     max(len(str(self.ai_core_usage)), 3) + len(" %") + len(", ") + \
                     max(len(str(self.memory_used)), 5) + len(" / ") + max(len(str(self.memory_total)), 5)
+        for field, _, field_format in DISPLAY_FORMATS:
+            if field in self.entry:
+                value = self.entry[field]
+                my_length += len(", ") + len(field_format.format("??" if value is None else value))
         return my_length
 
     def jsonify(self):
@@ -146,6 +195,26 @@ class AtlasCard:
         self.eol_char = eol_char
         self.term = term
 
+        # 累计能耗，单位：焦耳；只有 watch 模式及持续输出模式下才会由 EnergyMeter 计算
+        self.energy_j = None
+
+        self._formats = {}  # (show_power, 是否展示能耗) => 填充好颜色的模板
+
+    def update(self, entry):
+        """ 使用新一次采样的 entry 更新，DeviceID 相同的芯片复用已有的 Chip 对象 """
+        self.entry = entry
+        chips = {chip.device_id: chip for chip in self.chip_list}
+        chip_list = []
+        for chip_entry in entry["chip_entry_list"]:
+            chip = chips.get(chip_entry["device_id"])
+            if chip is None:
+                chip = Chip(chip_entry, self.term)
+            else:
+                chip.entry = chip_entry
+            chip_list.append(chip)
+        self.chip_list = chip_list
+        return self
+
     @property
     def card_id(self):
         return self.entry["card_id"]
@@ -165,28 +234,41 @@ class AtlasCard:
         colors["CBold"] = self.term.bold
         colors["CardType"] = self.term.bold_white
         colors["CardPower"] = self.term.magenta
+        colors["CardEnergy"] = self.term.bold_magenta
         return colors
 
-    def print_to(self, fp, card_type_width=16, chip_name_width=16, device_id_width=1, *args, **kwargs):
-        colors = self.get_color()
+    def get_format(self):
+        key = (self.show_power, self.energy_j is not None)
+        reps = self._formats.get(key)
+        if reps is None:
+            reps = ""
+            reps += "%(C1)s[{entry[card_id]}]%(C0)s" + ", "
+            reps += "%(CardType)s{entry[type]:{card_type_width}}%(C0)s, "
 
-        reps = ""
-        reps += "%(C1)s[{entry[card_id]}]%(C0)s" + ", "
-        reps += "%(CardType)s{entry[type]:{card_type_width}}%(C0)s, "
+            if self.show_power:
+                reps += "%(CardPower)s{power}%(C0)s"
+                if self.energy_j is not None:
+                    reps += ", %(CardEnergy)s{energy_wh:.2f} Wh%(C0)s"
 
-        if self.show_power:
-            reps += "%(CardPower)s{entry[power]:>3}%(C0)s"
+            reps = reps % self.get_color()
+            self._formats[key] = reps
+        return reps
 
+    def print_to(self, fp, card_type_width=16, chip_name_width=16, device_id_width=1, chips=None, *args, **kwargs):
         def _repr(v, none_value="??"):
             return none_value if v is None else v
 
-        reps = reps % colors
-        reps = reps.format(entry={k: _repr(v) for k, v in self.entry.items()}, card_type_width=card_type_width)
+        power = self.entry.get("power")
+        power = f"{power:.2f} W" if isinstance(power, (int, float)) else f"{_repr(power):>3}"
+
+        reps = self.get_format()
+        reps = reps.format(entry={k: _repr(v) for k, v in self.entry.items()}, card_type_width=card_type_width,
+                           power=power, energy_wh=(self.energy_j or 0.0) / 3600.0)
         fp.write(reps)
         fp.write(self.eol_char)
 
         # body
-        for chip in self:
+        for chip in (self if chips is None else chips):
             chip.print_to(fp, chip_name_width=chip_name_width, device_id_width=device_id_width)
             fp.write(self.eol_char)
         return fp
@@ -195,6 +277,9 @@ class AtlasCard:
         result = {"card_id": self.card_id, "type": self.type, }
         if self.show_power:
             result["power"] = self.power
+            if self.energy_j is not None:
+                result["energy_j"] = round(self.energy_j, 3)
+                result["energy_kwh"] = self.energy_j / JOULES_PER_KWH
         result["chips"] = [c.jsonify() for c in self]
         return result
 
@@ -212,18 +297,20 @@ class AtlasCardCollection:
     """ 当前机器上所有atlas加速卡的信息 """
 
     def __init__(self, card_entry_list, version, show_power=True, no_header=True, no_title=False,
-                 eol_char=os.linesep, force_color=False, compact=False, *args, **kwargs):
+                 eol_char=os.linesep, force_color=False, compact=False, query_time=None, term=None, *args, **kwargs):
         self.hostname = platform.node()
-        self.query_time = datetime.now()
+        self.query_time = query_time or datetime.now()
+        self.energy_since = None  # 开始累计能耗的时间，见 EnergyMeter
+        self.sampling = None  # 长时间运行模式下的有效采样间隔及查询开销，见 AdaptiveInterval
 
         self.version = version
-        self.show_power = show_power
+        self._show_power = show_power
         self.no_header = no_header
         self.no_title = no_title
         self.eol_char = eol_char
         self.compact = compact
 
-        self.term = self.get_term(force_color)
+        self.term = term if term is not None else self.get_term(force_color)
         if not no_title:
             self.title_colors = self.get_title_colors()
 
@@ -232,6 +319,37 @@ class AtlasCardCollection:
             atlas_card_list.append(AtlasCard(card_entry, show_power, eol_char, self.term, *args, **kwargs))
         self.atlas_card_list = atlas_card_list
 
+    def update(self, card_entry_list, version=None, query_time=None):
+        """
+        长时间运行模式下使用新一次采样的结果更新当前对象：复用 Terminal、颜色表以及 card_id 相同的 AtlasCard 对象，
+        避免每次采样都重新创建整棵对象树
+        """
+        if version is not None:
+            self.version = version
+        self.query_time = query_time or datetime.now()
+
+        atlas_cards = {atlas_card.card_id: atlas_card for atlas_card in self.atlas_card_list}
+        atlas_card_list = []
+        for card_entry in card_entry_list:
+            atlas_card = atlas_cards.get(card_entry["card_id"])
+            if atlas_card is None:
+                atlas_card = AtlasCard(card_entry, self.show_power, self.eol_char, self.term)
+            else:
+                atlas_card.update(card_entry)
+            atlas_card_list.append(atlas_card)
+        self.atlas_card_list = atlas_card_list
+        return self
+
+    @property
+    def show_power(self):
+        return self._show_power
+
+    @show_power.setter
+    def show_power(self, show_power):
+        self._show_power = show_power
+        for atlas_card in self.atlas_card_list:
+            atlas_card.show_power = show_power
+
     def get_term(self, force_color=False):
         if force_color:
             TERM = os.getenv("TERM") or "xterm-256color"
@@ -269,12 +387,15 @@ class AtlasCardCollection:
         header_template = "{t.bold_white}{hostname:{width}}{t.normal}  "
         header_template += "{time_str}  "
         header_template += "{t.bold_black}{driver_version}{t.normal}"
+        if self.sampling is not None:
+            header_template += "  {t.bold_black}采样间隔 {sampling[interval]:.1f}s{t.normal}"
 
         header_msg = header_template.format(
             hostname=self.hostname,
             width=card_type_width + 3,  # len("[?]")
             time_str=time_str,
             driver_version=self.version,
+            sampling=self.sampling,
             t=term,
         )
 
@@ -302,6 +423,9 @@ class AtlasCardCollection:
         title += "%(ChipAICore)sAICore%(C0)s, "
         title += "%(C1)s%(ChipMemU)s内存%(C0)s"
         title = title % self.title_colors
+        for field, field_title, _ in DISPLAY_FORMATS:
+            if any(field in chip.entry for atlas_card in self for chip in atlas_card):
+                title += ", " + field_title
         fp.write(title.strip())
         fp.write(eol_char)
 
@@ -310,7 +434,11 @@ class AtlasCardCollection:
             fp.write(eol_char)
             fp.write(eol_char)
 
-    def print_formatted(self, fp=sys.stdout, *args, **kwargs):
+    def print_formatted(self, fp=sys.stdout, rows=None, *args, **kwargs):
+        """ rows 为 [(atlas_card, chip_list), ...]，用于只展示过滤、排序之后的部分，默认展示全部 """
+        if rows is None:
+            rows = [(atlas_card, None) for atlas_card in self]
+
         # appearance settings
         card_type_width = [len(atlas_card.entry["type"]) for atlas_card in self]
         card_type_width = max([0] + card_type_width)
@@ -320,11 +448,11 @@ class AtlasCardCollection:
         device_id_width = max([0] + device_id_width)
 
         # header
-        if not self.no_header:
+        if not (self.no_header or self.compact):
             self.print_header(fp=fp, eol_char=self.eol_char, term=self.term, card_type_width=card_type_width)
 
         # title
-        if not self.no_title:
+        if not (self.no_title or self.compact):
             title_len = 66
             if self.atlas_card_list:
                 if self.atlas_card_list[0]:
@@ -332,9 +460,9 @@ class AtlasCardCollection:
             self.print_title(fp=fp, eol_char=self.eol_char, title_len=title_len)
 
         # body
-        for atlas_card in self:
+        for atlas_card, chips in rows:
             atlas_card.print_to(fp, card_type_width=card_type_width, chip_name_width=chip_name_width,
-                                device_id_width=device_id_width)
+                                device_id_width=device_id_width, chips=chips)
             if not self.compact:
                 fp.write(self.eol_char)
 
@@ -348,23 +476,30 @@ class AtlasCardCollection:
         return fp
 
     def jsonify(self):
-        return {
+        result = {
             "hostname": self.hostname,
             "query_time": self.query_time,
-            "atlas_cards": [atlas_card.jsonify() for atlas_card in self]
         }
+        if self.energy_since is not None:
+            result["energy_since"] = self.energy_since
+        if self.sampling is not None:
+            result["sampling"] = self.sampling
+        result["atlas_cards"] = [atlas_card.jsonify() for atlas_card in self]
+        return result
 
     def print_json(self, fp=sys.stdout):
-        def date_handler(obj):
-            if hasattr(obj, "isoformat"):
-                return obj.isoformat()
-            else:
-                raise TypeError(type(obj))
+        fp.write(SnapshotEncoder("json").encode(self).decode("utf-8"))
+        fp.flush()
 
-        o = self.jsonify()
-        json.dump(o, fp, indent=4, separators=(",", ": "), default=date_handler)
-        fp.write(os.linesep)
+    def print_encoded(self, fp=sys.stdout, encoder=None):
+        """ 使用 encoder 编码后输出；json-compact、msgpack 格式输出的是 bytes，写入 fp 底层的 buffer """
+        if encoder is None:
+            encoder = SnapshotEncoder("json")
+        data = encoder.encode(self)
         fp.flush()
+        buffer = getattr(fp, "buffer", fp)
+        buffer.write(data)
+        buffer.flush()
 
     def __len__(self):
         return len(self.atlas_card_list)
@@ -382,12 +517,45 @@ class AtlasCardCollection:
         return s
 
 
-def new_query(has_ascend_dmi, *args, **kwargs):
-    """Query the information of all the Atlas Card on local machine"""
-
+def query_backend(has_ascend_dmi, card_ids=None, device_ids=None, metrics=None):
+    """
+    调用 ascend-dmi / npu-smi 查询，返回 (version, card_entry_list, query_time)；
+    metrics 为开启的扩展指标组，如 ("hbm", "aicpu")，会对选中的每个芯片并发查询
+    """
     if has_ascend_dmi:
-        version, card_entry_list = GetCardStatusWithAscendDmi().new_query()
+        version, card_entry_list = GetCardStatusWithAscendDmi(card_ids, device_ids).new_query()
     else:
-        version, card_entry_list = GetCardStatusWithNpuSmi().new_query()
+        version, card_entry_list = GetCardStatusWithNpuSmi(card_ids, device_ids).new_query()
+    collect_extended_metrics(card_entry_list, metrics)
+    return version, card_entry_list, datetime.now()
+
 
-    return AtlasCardCollection(card_entry_list, version=version, *args, **kwargs)
+def new_query(has_ascend_dmi, card_ids=None, device_ids=None, metrics=None, cache=None, *args, **kwargs):
+    """
+    Query the information of all the Atlas Card on local machine;
+    card_ids / device_ids (sets of str) select a subset of cards / chips, which is filtered inside the backends;
+    metrics enables the extended metric groups, see npustat.metrics.METRIC_GROUPS;
+    cache is an optional QueryCache shared by the threads of a library caller.
+    """
+
+    if cache is None:
+        version, card_entry_list, query_time = query_backend(has_ascend_dmi, card_ids, device_ids, metrics)
+    else:
+        key = (has_ascend_dmi,
+               None if card_ids is None else frozenset(card_ids),
+               None if device_ids is None else frozenset(device_ids),
+               tuple(metrics or ()))
+        version, card_entry_list, query_time = cache.get(
+            key, lambda: query_backend(has_ascend_dmi, card_ids, device_ids, metrics))
+
+    return AtlasCardCollection(card_entry_list, version=version, query_time=query_time, *args, **kwargs)
+
+
+def update_collection(atlas_stat, result, *args, **kwargs):
+    """
+    长时间运行模式下使用：第一次采样时创建 AtlasCardCollection，之后复用该对象，只用 query_backend 的结果更新数据
+    """
+    version, card_entry_list, query_time = result
+    if atlas_stat is None:
+        return AtlasCardCollection(card_entry_list, version=version, query_time=query_time, *args, **kwargs)
+    return atlas_stat.update(card_entry_list, version=version, query_time=query_time)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+JOULES_PER_KWH = 3.6e6
+
+
+class EnergyMeter:
+    """
+    watch 模式及持续输出模式下，在多次采样之间对每张加速卡的实时功率做积分（梯形法），得到累计能耗；
+
+    每次采样只需要 O(加速卡数量) 的计算，累计结果会写回到每张 AtlasCard 上，随展示及 json 一起输出；
+    """
+
+    def __init__(self):
+        self.since = None
+        self.energy_j = {}
+        self._last = {}  # card_id => (采样时间戳, 功率)
+
+    def update(self, atlas_stat):
+        timestamp = atlas_stat.query_time.timestamp()
+        if self.since is None:
+            self.since = atlas_stat.query_time
+
+        for atlas_card in atlas_stat:
+            power = atlas_card.entry.get("power")
+            if not isinstance(power, (int, float)):
+                # 功率未知：跳过该加速卡，并且不对缺失读数的这段时间做积分
+                self._last.pop(atlas_card.card_id, None)
+                continue
+
+            card_id = atlas_card.card_id
+            energy_j = self.energy_j.get(card_id, 0.0)
+            last = self._last.get(card_id)
+            if last is not None and timestamp > last[0]:
+                energy_j += (timestamp - last[0]) * (power + last[1]) / 2.0
+            self.energy_j[card_id] = energy_j
+            self._last[card_id] = (timestamp, power)
+            atlas_card.energy_j = energy_j
+
+        atlas_stat.energy_since = self.since
+        return atlas_stat
+
+    @property
+    def total_j(self):
+        return sum(self.energy_j.values())
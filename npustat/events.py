@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from .view import to_number
+
+
+class EventDetector:
+    """
+    比较前后两次采样，只在状态发生变化时产生事件：
+
+    * health：芯片的 Health 发生变化，如 OK -> Warning；
+    * temperature / memory：温度、内存使用率超过阈值（high），回落到 阈值 - 回差 以下时才恢复（normal），避免在阈值附近反复跳变；
+    * card / chip：加速卡或芯片消失（absent）、重新出现（present）；
+
+    新的状态需要连续出现 confirm 次才会被确认；第一次采样作为基准，只对处于异常状态的项产生事件；
+    """
+
+    def __init__(self, temp_threshold=80, memory_threshold=90.0, temp_hysteresis=5, memory_hysteresis=5.0,
+                 confirm=1):
+        self.temp_threshold = temp_threshold
+        self.memory_threshold = memory_threshold
+        self.temp_hysteresis = temp_hysteresis
+        self.memory_hysteresis = memory_hysteresis
+        self.confirm = max(1, confirm)
+
+        self._states = {}  # (事件类型, card_id, device_id) => 当前确认的状态
+        self._pending = {}  # (事件类型, card_id, device_id) => (待确认的状态, 已连续出现的次数)
+
+    def _transition(self, key, state, normal_state, value=None):
+        """ 状态确认发生变化时返回事件，否则返回 None """
+        current = self._states.get(key)
+        if state == current:
+            self._pending.pop(key, None)
+            return None
+
+        if current is not None:
+            pending_state, count = self._pending.get(key, (None, 0))
+            count = count + 1 if pending_state == state else 1
+            if count < self.confirm:
+                self._pending[key] = (state, count)
+                return None
+            self._pending.pop(key, None)
+
+        self._states[key] = state
+        if current is None and state == normal_state:
+            return None
+
+        event = {"event": key[0], "card_id": key[1]}
+        if key[2] is not None:
+            event["device_id"] = key[2]
+        event["from"] = current
+        event["to"] = state
+        if value is not None:
+            event["value"] = value
+        return event
+
+    def _threshold_state(self, key, value, threshold, hysteresis):
+        if self._states.get(key) == "high":
+            return "high" if value >= threshold - hysteresis else "normal"
+        return "high" if value >= threshold else "normal"
+
+    def update(self, atlas_stat):
+        """ 输入新一次的采样，返回本次采样产生的事件列表 """
+        events = []
+        time_str = atlas_stat.query_time.isoformat()
+
+        def _emit(event):
+            if event is not None:
+                event["time"] = time_str
+                events.append(event)
+
+        present = set()
+        for atlas_card in atlas_stat:
+            card_id = atlas_card.card_id
+            present.add(("card", card_id, None))
+            _emit(self._transition(("card", card_id, None), "present", "present"))
+
+            for chip in atlas_card:
+                device_id = chip.device_id
+                present.add(("chip", card_id, device_id))
+                _emit(self._transition(("chip", card_id, device_id), "present", "present"))
+                _emit(self._transition(("health", card_id, device_id), chip.health, "OK"))
+
+                temperature = to_number(chip.temperature, default=None)
+                if temperature is not None:
+                    key = ("temperature", card_id, device_id)
+                    state = self._threshold_state(key, temperature, self.temp_threshold, self.temp_hysteresis)
+                    _emit(self._transition(key, state, "normal", temperature))
+
+                memory_used = to_number(chip.memory_used, default=None)
+                memory_total = to_number(chip.memory_total, default=None)
+                if memory_used is not None and memory_total:
+                    key = ("memory", card_id, device_id)
+                    usage = round(memory_used * 100.0 / memory_total, 1)
+                    state = self._threshold_state(key, usage, self.memory_threshold, self.memory_hysteresis)
+                    _emit(self._transition(key, state, "normal", usage))
+
+        # 本次采样中没有出现的加速卡、芯片
+        for key, state in list(self._states.items()):
+            if key[0] in ("card", "chip") and state == "present" and key not in present:
+                _emit(self._transition(key, "absent", "present"))
+        return events
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# 每个指标组 => (npu-smi info -t 的类型, {npu-smi 返回值中的字段名: entry 中的字段名})
+# 同一类型的多个指标组只会对每个芯片调用一次 npu-smi
+METRIC_GROUPS = {
+    "aicpu": ("usages", {"Aicpu Usage Rate(%)": "aicpu_usage"}),
+    "ctrlcpu": ("usages", {"Ctrlcpu Usage Rate(%)": "ctrl_cpu_usage"}),
+    "hbm": ("usages", {"HBM Bandwidth Usage Rate(%)": "hbm_bandwidth_usage",
+                       "DDR Bandwidth Usage Rate(%)": "ddr_bandwidth_usage"}),
+    "voltage": ("volt", {"Voltage(V)": "voltage"}),
+}
+
+# 扩展指标在终端中的 (字段名, title 中的名称, 展示格式)，只有 entry 中存在该字段（即开启了对应的指标组）时才会展示
+DISPLAY_FORMATS = (
+    ("aicpu_usage", "AICPU", "AICPU {:>3} %"),
+    ("ctrl_cpu_usage", "CtrlCPU", "CtrlCPU {:>3} %"),
+    ("hbm_bandwidth_usage", "HBM带宽", "HBM {:>3} %"),
+    ("ddr_bandwidth_usage", "DDR带宽", "DDR {:>3} %"),
+    ("voltage", "电压", "{} V"),
+)
+
+MAX_WORKERS = 16
+
+
+def parse_metric_groups(value):
+    """ 解析 "hbm,aicpu" 形式的指标组列表，返回有序去重后的 tuple """
+    groups = []
+    for group in value.split(","):
+        group = group.strip()
+        if not group:
+            continue
+        if group not in METRIC_GROUPS:
+            raise ValueError(f"不支持的指标组: {group}，可选值为: {', '.join(METRIC_GROUPS)}")
+        if group not in groups:
+            groups.append(group)
+    return tuple(groups)
+
+
+def parse_key_value(cmd_result):
+    """ 解析 npu-smi info -t xxx 返回的 "Key : Value" 形式的多行文本 """
+    result = {}
+    for line in cmd_result.split("\n"):
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        value = value.strip()
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        result[key.strip()] = value
+    return result
+
+
+def query_device(info_type, card_id, chip_id):
+    cmd = f"npu-smi info -t {info_type} -i {card_id} -c {chip_id}"
+    return parse_key_value(os.popen(cmd).read())
+
+
+def collect_extended_metrics(card_entry_list, groups):
+    """
+    为每个芯片并发地查询 groups 中的扩展指标，并写入芯片的 entry；
+    groups 为空时直接返回，不会有任何额外开销；查询失败或返回值中没有的字段为 None
+    """
+    if not groups:
+        return card_entry_list
+
+    info_types = {}  # npu-smi 类型 => {npu-smi 字段名: entry 字段名}
+    for group in groups:
+        info_type, fields = METRIC_GROUPS[group]
+        info_types.setdefault(info_type, {}).update(fields)
+
+    tasks = []
+    for card_entry in card_entry_list:
+        for chip_entry in card_entry["chip_entry_list"]:
+            for info_type in info_types:
+                tasks.append((chip_entry, info_type, card_entry["card_id"], chip_entry["chip_id"]))
+
+    def _run(task):
+        _, info_type, card_id, chip_id = task
+        try:
+            return query_device(info_type, card_id, chip_id)
+        except Exception:
+            return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(tasks)))) as executor:
+        results = list(executor.map(_run, tasks))
+
+    for (chip_entry, info_type, _, _), result in zip(tasks, results):
+        for name, field in info_types[info_type].items():
+            chip_entry[field] = result.get(name)
+    return card_entry_list
@@ -3,6 +3,7 @@
 
 import os
 import re
+import threading
 
 sub_space_p = re.compile(r"[ ]{2,}")  # 用于将多个连续空格替换成单个空格
 
@@ -46,21 +47,26 @@ class GetEntryCardListV1:
     # npu-smi info 命令返回值中没有 card_type 信息，首次展示前需要调用 npu-smi info -t product -i {card_id} 命令获取该信息
     # 对 card_type 信息举例："Atlas 300I Model 3000"
     card_id_to_card_type: dict = None
+    card_type_lock = threading.Lock()  # 多线程同时查询时，保证每个 card_id 只调用一次 npu-smi
 
     @staticmethod
     def get_card_type(all_card_ids):
-        if not GetEntryCardListV1.card_id_to_card_type:
-            card_id_to_card_type = {}
+        """ 只对尚未查询过的 card_id 调用 npu-smi，指定了 --id 时未选中的加速卡不会被查询 """
+        with GetEntryCardListV1.card_type_lock:
+            card_id_to_card_type = dict(GetEntryCardListV1.card_id_to_card_type or {})
             for card_id in all_card_ids:
+                if card_id in card_id_to_card_type:
+                    continue
                 cmd_result = os.popen(f"npu-smi info -t product -i {card_id}").read()
                 arr = cmd_result.split(":")
                 if len(arr) == 2:
                     card_id_to_card_type[card_id] = arr[1].strip()
 
             GetEntryCardListV1.card_id_to_card_type = card_id_to_card_type
-        return GetEntryCardListV1.card_id_to_card_type
+            return card_id_to_card_type
 
-    def get_card_entry(self, atlas_card_info):
+    def get_card_entry(self, atlas_card_info, card_ids=None, device_ids=None):
+        """ card_ids、device_ids 为选中的加速卡ID、DeviceID（字符串集合），为 None 时表示全部选中 """
         line_1_list, line_2_list = [], []
         for line in atlas_card_info.split("\n"):
             line = sub_space_p.sub(" ", line)
@@ -80,6 +86,13 @@ class GetEntryCardListV1:
             raise RuntimeError(f"解析 npu-smi info 结果失败，两个正则匹配上的行数不同\n"
                                f"{atlas_card_info}")
 
+        # 在查询 card_type 以及构造 entry 之前就去掉未选中的芯片
+        if card_ids is not None or device_ids is not None:
+            selected = [(line1, line2) for line1, line2 in zip(line_1_list, line_2_list)
+                        if (card_ids is None or line1[0] in card_ids) and (device_ids is None or line2[1] in device_ids)]
+            line_1_list = [line1 for line1, _ in selected]
+            line_2_list = [line2 for _, line2 in selected]
+
         all_card_ids = sorted(set([card_id for (card_id, _, _, _, _) in line_1_list]))
         card_id_to_card_type = GetEntryCardListV1.get_card_type(all_card_ids)
 
@@ -137,14 +150,14 @@ class GetEntryCardListV1:
         return temp
 
     def get_power(self, power):
+        """ 以瓦为单位的 float，无法解析时返回 None """
         power = power.strip()
         if power.endswith("W"):
             power = power[:-1].strip()
         try:
-            power = float(power)
-            return f"{power:.2f} W"
-        except Exception:
-            return f"{power} W"
+            return float(power)
+        except ValueError:
+            return None
 
 
 class GetCardStatusWithNpuSmi:
@@ -158,6 +171,10 @@ class GetCardStatusWithNpuSmi:
         "default": GetEntryCardListV1,
     }
 
+    def __init__(self, card_ids=None, device_ids=None):
+        self.card_ids = card_ids
+        self.device_ids = device_ids
+
     def new_query(self):
         atlas_card_info = os.popen("npu-smi info").read()
         version = self.get_version(atlas_card_info)
@@ -167,7 +184,7 @@ class GetCardStatusWithNpuSmi:
         else:
             my_class = self.version2func["default"]()
 
-        entry_list = my_class.get_card_entry(atlas_card_info)
+        entry_list = my_class.get_card_entry(atlas_card_info, card_ids=self.card_ids, device_ids=self.device_ids)
         return f"npu-smi version : {version}", entry_list
 
     def get_version(self, atlas_card_info):
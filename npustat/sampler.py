@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class Sampler:
+    """
+    后台采样线程：按固定的时间表调用 query_fn，最新一次采样结果放在单槽缓冲区中，旧的结果直接被覆盖；
+
+    采样时间表为 start, start + interval, start + 2 * interval, ...，查询本身的耗时被时间表吸收，不会累计漂移；
+    查询耗时超过 interval 时跳过已经错过的采样点，不会连续地补采；
+    前台线程只负责渲染，不会被耗时 1~3 秒的 ascend-dmi 查询阻塞；
+    指定 scheduler（见 AdaptiveInterval）时，每次查询之后使用 scheduler 给出的有效间隔安排下一次采样；
+    查询出错时默认停止采样；stop_on_error 为 False 时发布错误之后按时间表继续采样，用于需要长期运行的事件模式；
+    """
+
+    def __init__(self, query_fn, interval, scheduler=None, stop_on_error=True):
+        self.query_fn = query_fn
+        self.interval = interval
+        self.scheduler = scheduler
+        self.stop_on_error = stop_on_error
+
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._atlas_stat = None
+        self._error = None
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="npustat-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        # 正在进行的查询可能还需要几秒才能返回，线程为 daemon，不需要等待它结束
+        self.stop(timeout=0)
+
+    def get(self, after_seq=None, timeout=None):
+        """
+        返回 (seq, atlas_stat, error)；每次查询（无论成功还是出错）seq 都会加一，error 为最近一次查询的异常，
+        成功时为 None，此时 atlas_stat 为最近一次成功的采样；指定 after_seq 时，等待直到出现比 after_seq 更新的结果或超时
+        """
+        with self._cond:
+            if after_seq is not None:
+                self._cond.wait_for(lambda: self._seq > after_seq, timeout)
+            return self._seq, self._atlas_stat, self._error
+
+    def _publish(self, atlas_stat=None, error=None):
+        with self._cond:
+            self._seq += 1
+            if error is None:
+                self._atlas_stat = atlas_stat
+            self._error = error
+            self._cond.notify_all()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                if self.scheduler is not None:
+                    atlas_stat = self.scheduler.measure(self.query_fn)
+                else:
+                    atlas_stat = self.query_fn()
+            except Exception as e:
+                self._publish(error=e)
+                if self.stop_on_error:
+                    return
+            else:
+                self._publish(atlas_stat)
+
+            interval = self.scheduler.interval if self.scheduler is not None else self.interval
+            next_time += interval
+            now = time.monotonic()
+            if next_time < now:
+                missed = int((now - next_time) // interval) + 1
+                next_time += missed * interval
+            self._stop_event.wait(next_time - now)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+try:
+    import resource  # Windows 上不可用，退化为只统计当前进程的 CPU 时间
+except ImportError:
+    resource = None
+
+
+def cpu_time():
+    """
+    整个进程（所有线程）以及已经结束的子进程（npu-smi / ascend-dmi）消耗的 CPU 时间，单位：秒；
+
+    统计整个进程是为了包含 --metrics 在线程池中解析 npu-smi 输出的开销；查询期间前台渲染线程的开销也会被计算在内
+    """
+    if resource is None:
+        return time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+class AdaptiveInterval:
+    """
+    根据查询的开销自适应地调整采样间隔：
+
+    * 每次查询记录耗时及 CPU 时间（包括 npu-smi / ascend-dmi 子进程），使用指数移动平均（EWMA）平滑；
+    * 有效间隔 = max(INTERVAL, 平均CPU时间 / max_cpu_share, 平均耗时)，即查询占用的 CPU 不超过单核的 max_cpu_share，
+      并且不会一个查询刚结束就开始下一个查询；
+    * 开销变大时立即放慢，开销变小时只有目标间隔比当前间隔小 speedup_ratio 以上才加快，避免在边界附近来回跳变；
+    * 有效间隔不会小于 INTERVAL，也不会大于 max_interval；
+    """
+
+    speedup_ratio = 0.8
+
+    def __init__(self, interval, max_cpu_share=0.1, max_interval=60.0, alpha=0.3):
+        self.base_interval = interval
+        self.max_cpu_share = max_cpu_share
+        self.max_interval = max(interval, max_interval)
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self.interval = interval
+        self.latency = None  # 查询耗时的 EWMA，单位：秒
+        self.cpu_time = None  # 查询 CPU 时间的 EWMA，单位：秒
+        self.samples = 0
+
+    def measure(self, query_fn):
+        """ 执行一次查询并记录其开销，返回查询结果 """
+        start_time, start_cpu = time.monotonic(), cpu_time()
+        try:
+            return query_fn()
+        finally:
+            self.record(time.monotonic() - start_time, cpu_time() - start_cpu)
+
+    def _ewma(self, average, value):
+        return value if average is None else average + self.alpha * (value - average)
+
+    def record(self, latency, cpu):
+        with self._lock:
+            self.samples += 1
+            self.latency = self._ewma(self.latency, latency)
+            self.cpu_time = self._ewma(self.cpu_time, max(cpu, 0.0))
+
+            target = max(self.base_interval, self.cpu_time / self.max_cpu_share, self.latency)
+            target = min(target, self.max_interval)
+            if target > self.interval or target < self.interval * self.speedup_ratio:
+                self.interval = target
+            return self.interval
+
+    def snapshot(self):
+        """ 当前的有效间隔及查询开销，用于在 header 及 json 中展示 """
+        with self._lock:
+            cpu_share = self.cpu_time / self.interval if self.cpu_time is not None else None
+            return {
+                "interval": round(self.interval, 3),
+                "base_interval": self.base_interval,
+                "query_latency": round(self.latency, 4) if self.latency is not None else None,
+                "query_cpu_time": round(self.cpu_time, 4) if self.cpu_time is not None else None,
+                "query_cpu_share": round(cpu_share, 4) if cpu_share is not None else None,
+                "max_cpu_share": self.max_cpu_share,
+            }
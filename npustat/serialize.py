@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+from datetime import datetime
+
+try:
+    import orjson  # 可选依赖，安装之后 json-compact 格式使用 orjson 做编码
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack  # 可选依赖，仅 msgpack 格式需要
+except ImportError:
+    msgpack = None
+
+FORMATS = ("json", "json-compact", "msgpack")
+
+
+def dumps_compact(o):
+    """ 将对象编码为紧凑的 json，返回 utf-8 编码的 bytes """
+    if orjson is not None:
+        return orjson.dumps(o)
+    return json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def format_power(power):
+    """ json 格式中的功率与之前的输出保持一致，为 "16.30 W" 形式的字符串 """
+    return f"{power:.2f} W" if isinstance(power, (int, float)) else power
+
+
+class SnapshotEncoder:
+    """
+    将 AtlasCardCollection 编码为 json / json-compact / msgpack 格式；
+
+    json 格式与之前 --json 的输出保持一致（缩进为4，功率为 "16.30 W" 形式的字符串）；json-compact 和 msgpack 格式用于被其他程序解析，
+    每次采样输出一条记录，json-compact 以换行分隔，msgpack 本身可以流式解析；
+    长时间运行模式下多次采样之间复用同一个 encoder 及其 msgpack Packer；
+    """
+
+    def __init__(self, fmt="json"):
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}，可选值为: {', '.join(FORMATS)}")
+        if fmt == "msgpack" and msgpack is None:
+            raise RuntimeError("输出 msgpack 格式需要先安装 msgpack：pip install msgpack")
+        self.fmt = fmt
+        self._packer = msgpack.Packer(use_bin_type=True) if fmt == "msgpack" else None
+
+    @staticmethod
+    def to_builtin(atlas_stat):
+        """ 转换为只包含内置类型的对象，时间直接转换为 iso 格式字符串，不需要再借助 default 回调 """
+        o = atlas_stat.jsonify()
+        for k, v in o.items():
+            if isinstance(v, datetime):
+                o[k] = v.isoformat()
+        return o
+
+    def encode(self, atlas_stat):
+        o = self.to_builtin(atlas_stat)
+        if self.fmt == "json":
+            self.legacy_power(o)
+            return json.dumps(o, indent=4, separators=(",", ": ")).encode("utf-8") + b"\n"
+        if self.fmt == "json-compact":
+            return dumps_compact(o) + b"\n"
+        return self._packer.pack(o)
+
+    @staticmethod
+    def legacy_power(o):
+        """ 将加速卡、芯片（npu-smi）的数值功率转换为字符串；json-compact、msgpack 格式中为以瓦为单位的数值 """
+        for card in o.get("atlas_cards", []):
+            if "power" in card:
+                card["power"] = format_power(card["power"])
+            for chip in card.get("chips", []):
+                if "power" in chip:
+                    chip["power"] = format_power(chip["power"])
+        return o
+
+    def encode_record(self, o):
+        """ 编码一条只包含内置类型的记录（如 --events 产生的事件），json 格式同样输出为单行 """
+        if self.fmt == "msgpack":
+            return self._packer.pack(o)
+        return dumps_compact(o) + b"\n"
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import unicodedata
+
+from .view import to_number
+
+
+def display_width(text):
+    """ 终端中的显示宽度，中文等全角字符占两列 """
+    return sum(2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1 for ch in text)
+
+
+def pad(text, width, align="<"):
+    """ 按显示宽度补齐空格，align 为 "<" 时左对齐，">" 时右对齐 """
+    space = " " * max(0, width - display_width(text))
+    return text + space if align == "<" else space + text
+
+
+class P2Quantile:
+    """
+    P² 算法（Jain & Chlamtac, 1985）流式估计分位数：只保存5个标记点，内存占用与样本数量无关；
+    """
+
+    __slots__ = ("p", "count", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            values = sorted(self.heights)
+            index = int(math.ceil(self.p * len(values))) - 1
+            return values[max(0, min(len(values) - 1, index))]
+        return self.heights[2]
+
+
+class MetricStats:
+    """ 单个芯片单个指标的 min / max / mean 以及 p50 / p95 / p99 """
+
+    __slots__ = ("count", "min", "max", "total", "sketches")
+
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.sketches = [P2Quantile(q) for q in self.quantiles]
+
+    def add(self, x):
+        self.count += 1
+        self.total += x
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        for sketch in self.sketches:
+            sketch.add(x)
+
+    def percentile(self, q):
+        return self.sketches[self.quantiles.index(q)].value()
+
+    def summary(self):
+        result = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+        }
+        for q, sketch in zip(self.quantiles, self.sketches):
+            result[f"p{int(q * 100)}"] = sketch.value()
+        return result
+
+
+class SessionStats:
+    """
+    watch 模式及持续输出模式下，对每个芯片的 AICore、温度、内存做流式统计；
+
+    每个芯片每个指标只保存常数个数值，无论运行多久内存占用都不会增长；
+    """
+
+    # (字段名, 展示名称, 单位)
+    metrics = (
+        ("ai_core_usage", "AICore", "%"),
+        ("temperature", "温度", "°C"),
+        ("memory_used", "内存", "MB"),
+    )
+
+    def __init__(self):
+        self.samples = 0
+        self.since = None
+        self.chips = {}  # (card_id, device_id) => {字段名: MetricStats}
+
+    def update(self, atlas_stat):
+        self.samples += 1
+        if self.since is None:
+            self.since = atlas_stat.query_time
+
+        for atlas_card in atlas_stat:
+            for chip in atlas_card:
+                key = (atlas_card.card_id, chip.device_id)
+                chip_stats = self.chips.get(key)
+                if chip_stats is None:
+                    chip_stats = {name: MetricStats() for name, _, _ in self.metrics}
+                    self.chips[key] = chip_stats
+                for name, _, _ in self.metrics:
+                    value = to_number(chip.entry.get(name), default=None)
+                    if value is not None:
+                        chip_stats[name].add(value)
+
+    def footer(self):
+        """ watch 模式下展示的一行统计信息：每个指标 p95 最高的芯片 """
+        parts = [f"统计({self.samples}次采样)"]
+        for name, title, unit in self.metrics:
+            worst = None
+            for (card_id, device_id), chip_stats in self.chips.items():
+                p95 = chip_stats[name].percentile(0.95)
+                if p95 is not None and (worst is None or p95 > worst[0]):
+                    worst = (p95, device_id)
+            if worst is not None:
+                parts.append(f"{title} p95 最高: [{worst[1]}] {worst[0]:.0f}{unit}")
+        return ", ".join(parts)
+
+    def summary(self):
+        return {
+            "samples": self.samples,
+            "since": self.since.isoformat() if self.since is not None else None,
+            "chips": [
+                dict(card_id=card_id, device_id=device_id,
+                     **{name: chip_stats[name].summary() for name, _, _ in self.metrics})
+                for (card_id, device_id), chip_stats in self.chips.items()
+            ],
+        }
+
+    def print_json(self, fp):
+        json.dump(self.summary(), fp, indent=4, separators=(",", ": "), ensure_ascii=False)
+        fp.write("\n")
+        fp.flush()
+
+    def print_table(self, fp):
+        columns = ("min", "mean", "max", "p50", "p95", "p99")
+        fp.write(f"统计({self.samples}次采样)\n")
+        fp.write(pad("加速卡ID", 8, ">") + " " + pad("DeviceID", 8, ">") + "  " + pad("指标", 10) +
+                 "".join(f"{c:>9}" for c in columns) + "\n")
+
+        def _fmt(v):
+            return "??" if v is None else f"{v:.1f}"
+
+        for (card_id, device_id), chip_stats in self.chips.items():
+            for name, title, unit in self.metrics:
+                s = chip_stats[name].summary()
+                row = pad(str(card_id), 8, ">") + " " + pad(str(device_id), 8, ">") + "  " + pad(f"{title}({unit})", 10)
+                row += "".join(f"{_fmt(s[c]):>9}" for c in columns)
+                fp.write(row + "\n")
+        fp.flush()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+
+number_p = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+def to_number(value, default=-1.0):
+    """ 将 49、"49C"、"2621 MB"、"16.30 W" 之类的值转换为数值，无法转换时返回 default """
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = number_p.search(str(value)) if value is not None else None
+    return float(m.group()) if m else default
+
+
+class WatchView:
+    """
+    watch 模式下的展示状态：排序方式、过滤条件、紧凑模式、是否展示功率；
+
+    按键只修改展示状态，然后基于已经获取到的数据重新渲染，不需要重新查询设备信息；
+    """
+
+    # 按键 => (排序字段名称, 排序使用的取值函数)
+    sort_keys = {
+        "t": ("温度", lambda chip: to_number(chip.temperature)),
+        "a": ("AICore", lambda chip: to_number(chip.ai_core_usage)),
+        "m": ("内存", lambda chip: to_number(chip.memory_used)),
+    }
+
+    help_text = "t/a/m/o 按温度/AICore/内存/原顺序排序, h 只看异常, f 切换加速卡, c 紧凑, p 功率, q 退出"
+
+    def __init__(self, compact=False, show_power=True, can_show_power=True):
+        self.sort_by = None
+        self.unhealthy_only = False
+        self.card_id = None
+        self.compact = compact
+        self.show_power = show_power
+        self.can_show_power = can_show_power
+
+    def handle_key(self, key, atlas_stat=None):
+        """ 处理一次按键，展示状态发生变化时返回 True """
+        key = str(key)
+        if key in self.sort_keys:
+            self.sort_by = key
+        elif key == "o":
+            self.sort_by = None
+        elif key == "h":
+            self.unhealthy_only = not self.unhealthy_only
+        elif key == "f":
+            self.card_id = self.next_card_id(atlas_stat)
+        elif key == "c":
+            self.compact = not self.compact
+        elif key == "p" and self.can_show_power:
+            self.show_power = not self.show_power
+        else:
+            return False
+        return True
+
+    def next_card_id(self, atlas_stat):
+        """ 在 全部 -> 第一张卡 -> ... -> 最后一张卡 -> 全部 之间循环切换 """
+        card_ids = [atlas_card.card_id for atlas_card in atlas_stat] if atlas_stat is not None else []
+        if self.card_id not in card_ids:
+            return card_ids[0] if card_ids else None
+        index = card_ids.index(self.card_id) + 1
+        return card_ids[index] if index < len(card_ids) else None
+
+    def arrange(self, atlas_stat):
+        """ 按照当前的展示状态对加速卡及芯片做过滤、排序，返回 [(atlas_card, chip_list), ...] """
+        rows = []
+        for atlas_card in atlas_stat:
+            if self.card_id is not None and atlas_card.card_id != self.card_id:
+                continue
+            chips = list(atlas_card)
+            if self.unhealthy_only:
+                chips = [chip for chip in chips if chip.health != "OK"]
+                if not chips:
+                    continue
+            rows.append((atlas_card, chips))
+
+        if self.sort_by is not None:
+            value_fn = self.sort_keys[self.sort_by][1]
+            for _, chips in rows:
+                chips.sort(key=value_fn, reverse=True)
+            rows.sort(key=lambda row: max([value_fn(chip) for chip in row[1]] or [-1.0]), reverse=True)
+        return rows
+
+    def apply(self, atlas_stat):
+        """ 将紧凑模式、功率展示状态同步到数据上 """
+        atlas_stat.compact = self.compact
+        atlas_stat.show_power = self.show_power
+
+    def status_line(self, age=None, interval=None):
+        sort_name = self.sort_keys[self.sort_by][0] if self.sort_by is not None else "原顺序"
+        card = "全部" if self.card_id is None else f"[{self.card_id}]"
+        health = "异常" if self.unhealthy_only else "全部"
+        line = f"排序: {sort_name} | 加速卡: {card} | Health: {health} | {self.help_text}"
+        if interval is not None:
+            line = f"采样间隔 {interval:.1f}s | " + line
+        if age is not None:
+            line = f"采样于 {max(age, 0.0):.1f}s 前 | " + line
+        return line